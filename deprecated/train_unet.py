@@ -3,7 +3,6 @@ import os
 import glob
 import cv2
 import numpy as np
-from matplotlib import pyplot as plt
 import argparse
 
 from keras.models import Model
@@ -71,7 +70,8 @@ def multi_unet_model(n_classes=4, IMG_HEIGHT=256, IMG_WIDTH=256, IMG_CHANNELS=1)
   c9 = Dropout(0.1)(c9)
   c9 = Conv2D(16, (3, 3), activation='relu', kernel_initializer='he_normal', padding='same')(c9)
 
-  outputs = Conv2D(n_classes, (1, 1), activation='softmax')(c9)
+  #keep the softmax in float32 so outputs stay stable under a mixed precision policy
+  outputs = Conv2D(n_classes, (1, 1), activation='softmax', dtype='float32')(c9)
 
   model = Model(inputs=[inputs], outputs=[outputs])
 
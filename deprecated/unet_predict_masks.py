@@ -1,17 +1,36 @@
-from keras.utils import normalize
+from keras import mixed_precision
+import tensorflow as tf
 import os
-import glob
 import cv2
 import numpy as np
-from matplotlib import pyplot as plt
 import pandas as pd
 import argparse
-from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
 
 from train_unet import get_model
 from utils import load_dataset_images
 
 
+def normalize_images(images, dtype=np.float32):
+    '''L2-normalize a stack of grayscale images along the height axis (same as keras normalize(axis=1))
+    and add the channel axis, building the model input batch without intermediate float64 copies'''
+    normalized_images = images.astype(np.float32)
+    norms = np.linalg.norm(normalized_images, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    normalized_images /= norms
+    return np.expand_dims(normalized_images, axis=3).astype(dtype, copy=False)
+
+
+def save_mask(mask_path, mask, png_params):
+    '''Save a mask with opencv to preserve pixel categories. Returns the path if the mask could not be saved'''
+    try:
+        saved = cv2.imwrite(mask_path, mask, png_params)
+    except cv2.error:
+        saved = False
+
+    return None if saved else mask_path
+
+
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("--model_save_path", required=True, default = 'multiclass_unet.hdf5', help="Directory containing all folders with original size images.")
@@ -19,6 +38,9 @@ def parse_args():
     parser.add_argument("--main_folder_name", required=True, help="JUST the main FOLDER NAME containing all subfolders/images. ex: jiggins_256_256")
     parser.add_argument("--segmentation_csv", required=True, default = 'segmentation_info.csv', help="Path to the csv created containing \
                         which segmentation classes are present in each image's predicted mask.")
+    parser.add_argument("--batch_size", required=False, default=32, type=int, help="Number of images to run through the model at once.")
+    parser.add_argument("--mixed_precision", action="store_true", help="Run inference with mixed FP16 precision (recommended on GPUs with tensor cores).")
+    parser.add_argument("--verbose", action="store_true", help="Print the classes found in each predicted mask.")
     return parser.parse_args()
 
 
@@ -32,16 +54,26 @@ def main():
     #main folder name is used to create a new directory under a modified version of the original folder name
     folder_name = args.main_folder_name
 
+    # Run conv layers in FP16 on tensor cores while keeping FP32 weights
+    if args.mixed_precision:
+        mixed_precision.set_global_policy('mixed_float16')
+
     # Load in trained model
     model = get_model(n_classes=11, img_height=256, img_width=256, img_channels=1)
     model.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
     model.load_weights(args.model_save_path)
 
+    #fold the argmax into the model so it returns uint8 label masks rather than per-class float probabilities
+    mask_model = tf.keras.Model(model.input, tf.cast(tf.argmax(model.output, -1), tf.uint8))
+
+    #the input shape is fixed, so let XLA compile the forward pass into fused kernels once
+    mask_model.compile(jit_compile=True)
+
     #preprocess images
-    normalized_dataset_images = np.expand_dims(dataset_images, axis=3)
-    normalized_dataset_images = normalize(normalized_dataset_images, axis=1)
+    input_dtype = np.float16 if args.mixed_precision else np.float32
+    normalized_dataset_images = normalize_images(dataset_images, input_dtype)
     
-    #create a dataframe to store all metadata associated with predicted masks
+    #segmentation classes predicted by the model
     classes = {0: 'background',
             1: 'generic',
             2: 'right_forewing',
@@ -53,50 +85,45 @@ def main():
             8: 'label',
             9: 'color_card',
             10: 'body'}
-    
-    dataset_segmented = pd.DataFrame(columns = ['image', 'background', 
-                                            'generic', 'right_forewing', 
-                                            'left_forewing', 'right_hindwing', 
-                                            'left_hindwing', 'ruler', 'white_balance', 
-                                            'label', 'color_card', 'body', 'damaged'])
-    
 
-    i = 0 #dataframe indexer
-    errors = []
-    for test_img, fp in zip(normalized_dataset_images, image_filepaths):
-        #use the unet model to predict the mask on the image
-        test_img_norm = test_img[:,:,0][:,:,None]
-        test_image_input = np.expand_dims(test_img_norm, 0)
-        prediction = (model.predict(test_image_input))
-        predicted_img = np.argmax(prediction, axis=3)[0,:,:]
-        print('MASK VALUES:', np.unique(predicted_img))
-
-        #save the entire predicted mask under its own folder
-        mask_path = fp.replace(folder_name, f'{folder_name}_masks')
-        mask_path = mask_path.replace('.png', '_mask.png')
-        mask_fn = "/" + mask_path.split('/')[-1]
-        mask_folder = mask_path.replace(mask_fn, "")
-        os.makedirs(mask_folder, exist_ok=True)
-        
-        #save mask with cv2 to preserve pixel categories
-        cv2.imwrite(mask_path, predicted_img)
-
-        #enter relevant segmentation data for the image in our dataframe
-        classes_in_image = np.unique(predicted_img)
-        classes_not_in_image = set(classes.keys()) ^ set(classes_in_image)
-        dataset_segmented.loc[i, 'image'] = fp
-        
-        #enter `1` for all segmentation classes that appear in our mask
-        for val in classes_in_image:
-            pred_class = classes[val]
-            dataset_segmented.loc[i, pred_class] = 1 #class exists in segmentation mask
-
-        #enter `0` for all segmentation classes that were not predicted
-        for not_pred_val in classes_not_in_image:
-            not_pred_class = classes[not_pred_val]
-            dataset_segmented.loc[i, not_pred_class] = 0 #class does not exist in segmentation mask
-
-        i += 1
+    #predict masks for the whole dataset in batches rather than one image at a time
+    predicted_imgs = mask_model.predict(normalized_dataset_images, batch_size=args.batch_size, verbose=0)
+
+    #masks are low-entropy label images, so fast RLE-based png compression is nearly free
+    png_params = [cv2.IMWRITE_PNG_COMPRESSION, 1, cv2.IMWRITE_PNG_STRATEGY, cv2.IMWRITE_PNG_STRATEGY_RLE]
+
+    masks_folder_name = f'{folder_name}_masks'
+    saved_masks = [] #futures for each mask being written
+    mask_folders = set() #folders we've already created
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+        for predicted_img, fp in zip(predicted_imgs, image_filepaths):
+            if args.verbose:
+                print('MASK VALUES:', np.unique(predicted_img))
+
+            #save the entire predicted mask under its own folder
+            mask_folder, image_name = os.path.split(fp.replace(folder_name, masks_folder_name))
+            mask_path = os.path.join(mask_folder, image_name.replace('.png', '_mask.png'))
+            if mask_folder not in mask_folders:
+                os.makedirs(mask_folder, exist_ok=True)
+                mask_folders.add(mask_folder)
+
+            #save mask with cv2 to preserve pixel categories (writes happen in the background)
+            saved_masks.append(pool.submit(save_mask, mask_path, predicted_img, png_params))
+
+    #collect any masks that failed to save
+    errors = [future.result() for future in saved_masks if future.result() is not None]
+    if errors:
+        print('The following masks could not be saved:', errors)
+
+    #enter `1` for all segmentation classes that appear in each mask and `0` for those that were not predicted
+    presence = np.zeros((len(image_filepaths), len(classes)), dtype=np.uint8)
+    for class_id in classes.keys():
+        presence[:, class_id] = (predicted_imgs == class_id).any(axis=(1, 2))
+
+    #create a dataframe to store all metadata associated with predicted masks
+    dataset_segmented = pd.DataFrame(presence, columns=list(classes.values()))
+    dataset_segmented.insert(0, 'image', image_filepaths)
+    dataset_segmented['damaged'] = None
 
     #save csv containing information about segmentation masks per each image
     dataset_segmented.to_csv(args.segmentation_csv, index=False)
@@ -1,7 +1,4 @@
 import os
-import glob
-import cv2
-import matplotlib.pyplot as plt
 import argparse
 import shutil
 
@@ -27,10 +24,13 @@ def get_wing_path(main_folder, img_path):
     return wing_path
 
 def write_images_to_wing_folders(main_folder):
-    #go through each species subfolder
-    for directory_path in glob.glob(main_folder + '/*'):
-        if os.path.isfile(directory_path):
-            img_path = directory_path
+    #go through each species subfolder (scandir entries carry their file type, so no extra stat per path)
+    for entry in os.scandir(main_folder):
+        if entry.name.startswith('.'):
+            continue #skip hidden files
+
+        if entry.is_file():
+            img_path = entry.path
 
             #get new path where the cropped wing will be stored
             wing_path = get_wing_path(main_folder, img_path)
@@ -38,9 +38,12 @@ def write_images_to_wing_folders(main_folder):
             #copy the img to its new wing folder
             shutil.copy(img_path, wing_path)
 
-        elif os.path.isdir(directory_path):
+        elif entry.is_dir():
             #go through each image in the current species subfolder
-            for img_path in glob.glob(os.path.join(directory_path, "*.png")):
+            for img_entry in os.scandir(entry.path):
+                if img_entry.name.startswith('.') or not img_entry.name.endswith('.png'):
+                    continue
+                img_path = img_entry.path
                 
                 #get new path where the cropped wing will be stored
                 wing_path = get_wing_path(main_folder, img_path)
@@ -1,28 +1,45 @@
 import os
 import glob
 import cv2
-import matplotlib.pyplot as plt
 import argparse
-import shutil
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+def flip_image(img_path, wing_path, color_option=1):
+    '''Flip a single image horizontally and save it to wing_path'''
+    print(wing_path)
+    
+    #load the actual image file
+    img = cv2.imread(img_path, color_option)
+
+    #flip the image
+    img_h = cv2.flip(img, 1)
+
+    #save the flipped image in the new location
+    saved_img = cv2.imwrite(wing_path, img_h)
+    return saved_img
+
 
 def flip_images(source_folder, dest_folder, color_option=1):
     #go through each species subfolder
     file_extensions = ["jpg", "JPG", "jpeg", "png"]
+
+    img_paths = []
+    wing_paths = []
     for ext in file_extensions:
         for img_path in glob.glob(os.path.join(source_folder, f"*.{ext}")):
 
             #create the new path to save the image under its wing folder
-            wing_path = img_path.replace(source_folder, dest_folder)
-            print(wing_path)
-            
-            #load the actual image file
-            img = cv2.imread(img_path, color_option)
-
-            #flip the image
-            img_h = cv2.flip(img, 1)
+            img_paths.append(img_path)
+            wing_paths.append(img_path.replace(source_folder, dest_folder))
 
-            #save the flipped image in the new location
-            saved_img = cv2.imwrite(wing_path, img_h)
+    #decode/flip/encode images in parallel, handing each worker a chunk of paths at a time
+    #(about 4 chunks per worker, cutting down on inter-process overhead while still balancing the load)
+    num_workers = os.cpu_count()
+    chunksize = max(1, len(img_paths) // (num_workers * 4))
+    with ProcessPoolExecutor(max_workers=num_workers) as pool:
+        flip = partial(flip_image, color_option=color_option)
+        list(pool.map(flip, img_paths, wing_paths, chunksize=chunksize)) #consume results to surface any errors raised while flipping
 
     return
 
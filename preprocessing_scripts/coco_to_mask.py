@@ -2,9 +2,7 @@ from pycocotools.coco import COCO
 import os
 from PIL import Image
 import numpy as np
-from matplotlib import pyplot as plt
 import cv2
-import json
 
 
 def anns_to_multiclass_mask(coco_json_file, save_mask_dir, mask_size=(128,128), save=False):
@@ -31,14 +29,10 @@ def anns_to_multiclass_mask(coco_json_file, save_mask_dir, mask_size=(128,128),
         for i in range(1, len(anns)):
             category_mask = (anns[i]['category_id']) * coco.annToMask(anns[i])
             category_mask = cv2.resize(category_mask, mask_size, interpolation=cv2.INTER_NEAREST)
-            multiclass_mask += category_mask
 
-            for y in range(0, category_mask.shape[0]):
-                for x in range(0, category_mask.shape[1]):
-                    #if there masks overlap at y,x
-                    if category_mask[y, x] != 0 and multiclass_mask[y,x] != 0:
-                        #replace that value to avoid pixel values not in our id2label mapping
-                        multiclass_mask[y,x] = category_mask[y,x]
+            #layer the category into the mask, overwriting where masks overlap
+            #to avoid pixel values not in our id2label mapping
+            np.copyto(multiclass_mask, category_mask, where=category_mask != 0)
 
         #save the mask
         if save:
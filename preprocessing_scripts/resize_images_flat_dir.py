@@ -4,24 +4,37 @@ import argparse
 import cv2
 import glob 
 import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from utils import get_resize_interpolation, get_chunksize
+
+
+def resize_image(filename, resized_image_folder, image_size):
+    '''Resize a single image and save it as a png in the resized_image_folder'''
+    print(filename)
+    image = Image.open(filename)
+    image = np.array(image) #convert to numpy to resize
+    image = cv2.resize(image, image_size, interpolation=get_resize_interpolation(image, image_size))
+
+    image_name = filename.split("/")[-1] #get rid of everything but the name of the file
+    image_name = image_name.split(".")[0] #get rid of the extension
+    image = Image.fromarray(image) #convert img back to PIL Image to save
+    image.save(f"{resized_image_folder}/{image_name}.png") #save as a png image to avoid pixel val changes
 
 
 def resize_images(source_image_folder, resized_image_folder, file_extensions, image_size=(256,256)):
     #create a new folder to save resized images to
     os.makedirs(resized_image_folder, exist_ok=True)
 
-    #begin resizing
-    for extension in file_extensions:
-        for filename in glob.glob(f'{source_image_folder}/*{extension}'):
-            print(filename)
-            image = Image.open(filename)
-            image = np.array(image) #convert to numpy to resize
-            image = cv2.resize(image, image_size, interpolation=cv2.INTER_AREA)
-
-            image_name = filename.split("/")[-1] #get rid of everything but the name of the file
-            image_name = image_name.split(".")[0] #get rid of the extension
-            image = Image.fromarray(image) #convert img back to PIL Image to save
-            image.save(f"{resized_image_folder}/{image_name}.png") #save as a png image to avoid pixel val changes
+    #begin resizing, spreading the cpu-bound decode/resize/encode work across processes
+    filenames = [filename for extension in file_extensions for filename in glob.glob(f'{source_image_folder}/*{extension}')]
+    #(images are sent to the workers in chunks to cut down on inter-process overhead)
+    num_workers = os.cpu_count()
+    chunksize = get_chunksize(len(filenames), num_workers)
+    with ProcessPoolExecutor(max_workers=num_workers) as pool:
+        resize = partial(resize_image, resized_image_folder=resized_image_folder, image_size=image_size)
+        list(pool.map(resize, filenames, chunksize=chunksize)) #consume results to surface any errors raised while resizing
     
     return
 
@@ -4,34 +4,54 @@ import argparse
 import cv2
 import glob 
 import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from utils import get_resize_interpolation, get_chunksize
+
+def resize_image(filename, save_filename, image_size):
+    '''Resize a single image and save it as a png. Returns the filename if the image could not be resized'''
+    try:
+        image = Image.open(filename)
+        image = np.array(image) #convert to numpy to resize
+        image = cv2.resize(image, image_size, interpolation=get_resize_interpolation(image, image_size))
+        print(save_filename)
+
+        image = Image.fromarray(image) #convert img back to PIL Image to save
+        image.save(save_filename) #save as a png image to avoid pixel val changes
+    except OSError:
+        return filename
+
+    return None
+
 
 def resize_images(dataset_path, resized_image_folder, main_folder_name, file_extensions, image_size=(256, 256)):
     #create a new folder to save resized images to
     os.makedirs(resized_image_folder.replace("*", ""), exist_ok=True)
 
     print('starting...')
-    #begin resizing
-    not_resized = []
+    #gather every image to resize along with the path to save it to
+    filenames = []
+    save_filenames = []
+    resized_folder_name = f'{main_folder_name}_{image_size[0]}_{image_size[1]}'
     for species_folder_path in glob.glob(dataset_path):
         print('FOLDER', species_folder_path)
+        os.makedirs(species_folder_path.replace(main_folder_name, resized_folder_name), exist_ok=True) #make sure the save dir exists
         for extension in file_extensions:
             dir = species_folder_path + f"/*.{extension}"
-            os.makedirs(species_folder_path.replace(main_folder_name, f'{main_folder_name}_{image_size[0]}_{image_size[1]}'), exist_ok=True) #make sure the save dir exists
             for filename in glob.glob(dir): #os.path.join(species_folder_path, f"/*.{extension}")
+                save_filename = filename.replace(main_folder_name, resized_folder_name)
+                save_filename = save_filename.replace(save_filename.split('.')[-1], 'png')
+                filenames.append(filename)
+                save_filenames.append(save_filename)
 
-                try:
-                    image = Image.open(filename)
-                    image = np.array(image) #convert to numpy to resize
-                    image = cv2.resize(image, image_size, interpolation=cv2.INTER_AREA)
-
-                    save_filename = filename.replace(main_folder_name, f'{main_folder_name}_{image_size[0]}_{image_size[1]}')
-                    save_filename = save_filename.replace(save_filename.split('.')[-1], 'png')
-                    print(save_filename)
-
-                    image = Image.fromarray(image) #convert img back to PIL Image to save
-                    image.save(save_filename) #save as a png image to avoid pixel val changes
-                except OSError:
-                    not_resized.append(filename)
+    #begin resizing, spreading the cpu-bound decode/resize/encode work across processes
+    #(images are sent to the workers in chunks to cut down on inter-process overhead)
+    num_workers = os.cpu_count()
+    chunksize = get_chunksize(len(filenames), num_workers)
+    with ProcessPoolExecutor(max_workers=num_workers) as pool:
+        results = pool.map(partial(resize_image, image_size=image_size), filenames, save_filenames, chunksize=chunksize)
+        not_resized = [filename for filename in results if filename is not None]
     
     return not_resized
 
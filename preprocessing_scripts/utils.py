@@ -0,0 +1,15 @@
+import cv2
+
+
+def get_resize_interpolation(image, image_size):
+    '''Get the opencv interpolation for resizing image to image_size (width, height):
+    INTER_AREA to shrink (avoids aliasing) and the cheaper INTER_LINEAR to enlarge'''
+    if image.shape[0] * image.shape[1] > image_size[0] * image_size[1]:
+        return cv2.INTER_AREA
+    return cv2.INTER_LINEAR
+
+
+def get_chunksize(num_tasks, num_workers):
+    '''Get how many tasks to send to a worker process at a time so each worker gets about 4 chunks,
+    cutting down on inter-process overhead while still balancing the load'''
+    return max(1, num_tasks // (num_workers * 4))
@@ -1,9 +1,8 @@
 import os
-import glob
 import cv2
 import numpy as np
-import pandas as pd
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 
 from utils import load_dataset_images
 
@@ -14,32 +13,26 @@ def crop_wings(test_img, predicted_img, padding=50, cropped_dim=(256, 256)):
   cropped_wings = dict()
   cropped_wings_resized = dict()
 
+  #count the pixels of every class once so we can skip wings missing from the mask
+  class_pixel_counts = np.bincount(predicted_img.ravel(), minlength=5)
+
   #only search for masks belonging to right/left hindwings and forewings
   for wing_class in [1,2,3,4]: #[2,3,4,5]:
-    img = test_img #[:,:, 0]
-    mask = np.asarray(predicted_img==wing_class, dtype=int) #0s and 1s
-
-    y_coords = []
-    x_coords = []
-    for y in range(0, mask.shape[0]):
-      for x in range(0, mask.shape[1]):
-        if mask[y,x]==1:
-          x_coords.append(x)
-          y_coords.append(y)
-
     #our mask is empty - therefore no existing mask for that wing
-    if len(x_coords) == 0 and len(y_coords) == 0:
+    if class_pixel_counts[wing_class] == 0:
       print("empty mask for wing key:", wing_class)
       continue
 
-    #sort the x and y coordinates of our segmented wing mask to crop accordingly
-    x_coords.sort()
-    y_coords.sort()
+    img = test_img #[:,:, 0]
+
+    #get the coordinates of every wing pixel in one vectorized pass over the mask
+    y_coords, x_coords = np.nonzero(predicted_img == wing_class)
 
-    miny = y_coords[0]
-    maxy = y_coords[-1]
-    minx = x_coords[0]
-    maxx= x_coords[-1]
+    #get the extent of our segmented wing mask to crop accordingly
+    miny = y_coords.min()
+    maxy = y_coords.max()
+    minx = x_coords.min()
+    maxx = x_coords.max()
 
     #get boundaries of segmented mask with some extra room
     if miny >= padding:
@@ -48,10 +41,10 @@ def crop_wings(test_img, predicted_img, padding=50, cropped_dim=(256, 256)):
     if minx >= padding:
       minx -= padding
     
-    if maxy <= (mask.shape[0] - padding):
+    if maxy <= (predicted_img.shape[0] - padding):
       maxy += padding
     
-    if maxx <= (mask.shape[1] - padding):
+    if maxx <= (predicted_img.shape[1] - padding):
       maxx += padding
 
     #crop image down to segmented wings
@@ -66,6 +59,16 @@ def crop_wings(test_img, predicted_img, padding=50, cropped_dim=(256, 256)):
   return cropped_wings, cropped_wings_resized
 
 
+def save_cropped_wing(cropped_wing_path, cropped_wing):
+    '''Save a cropped wing with opencv. Returns the path if the wing could not be saved'''
+    try:
+        saved = cv2.imwrite(cropped_wing_path, cropped_wing)
+    except (FileNotFoundError, cv2.error):
+        saved = False
+
+    return None if saved else cropped_wing_path
+
+
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("--images", required=True, help="Directory containing images we want to predict masks for. ex: /User/micheller/data/jiggins_256_256")
@@ -81,7 +84,8 @@ def main():
 
     # load in our images
     image_dataset_folder = args.images + '/*'
-    dataset_images, image_filepaths = load_dataset_images(image_dataset_folder, color_option=1)
+    #keep opencv's BGR order since the crops are only written back out with opencv
+    dataset_images, image_filepaths = load_dataset_images(image_dataset_folder, color_option=1, rgb=False)
 
     #load in our masks
     mask_dataset_folder = args.masks + '/*'
@@ -101,30 +105,38 @@ def main():
     
 
     errors = []
-    for (image, mask), fp in zip(zip(dataset_images, dataset_masks), image_filepaths):   
-        #crop + extract any existing wings
-        cropped_wings, cropped_wings_resized = crop_wings(image, mask, args.pad)
-
-        #save each individual wing with a traceable name to the source image 
-        #(ex. erato_0001_wing_2.png denotes the image contains the right forewing for erato_0001.png)
-        for wing_idx in cropped_wings.keys():
-            cropped_wing = cropped_wings[wing_idx]
-            cropped_wing_resized = cropped_wings_resized[wing_idx]
-
-            #create path to save the resized wing crops to
-            new_folder = fp.replace(image_dataset_folder.replace("*", ""), args.output_folder + '/')
-            ext = new_folder.split('.')[-1]
-            cropped_wing_path = new_folder.replace(f'.{ext}', f'_wing_{wing_idx}.png')
-            r = "/" + cropped_wing_path.split('/')[-1]
-            cropped_wing_folder = cropped_wing_path.replace(r, "")
-            os.makedirs(cropped_wing_folder, exist_ok=True)
-
-            #save the cropped wings to their path (these images will be resized to cropped_dim)
-            try:
+    saved_wings = [] #futures for each crop being written
+    cropped_wing_folders = set() #folders we've already created
+    #encode + write the crops from a thread pool so disk I/O overlaps with cropping the next images
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+        for (image, mask), fp in zip(zip(dataset_images, dataset_masks), image_filepaths):   
+            #crop + extract any existing wings
+            cropped_wings, cropped_wings_resized = crop_wings(image, mask, args.pad)
+
+            #save each individual wing with a traceable name to the source image 
+            #(ex. erato_0001_wing_2.png denotes the image contains the right forewing for erato_0001.png)
+            for wing_idx in cropped_wings.keys():
+                cropped_wing = cropped_wings[wing_idx]
+                cropped_wing_resized = cropped_wings_resized[wing_idx]
+
+                #create path to save the resized wing crops to
+                new_folder = fp.replace(image_dataset_folder.replace("*", ""), args.output_folder + '/')
+                ext = new_folder.split('.')[-1]
+                cropped_wing_path = new_folder.replace(f'.{ext}', f'_wing_{wing_idx}.png')
+                cropped_wing_folder = os.path.dirname(cropped_wing_path)
+                if cropped_wing_folder not in cropped_wing_folders:
+                    os.makedirs(cropped_wing_folder, exist_ok=True)
+                    cropped_wing_folders.add(cropped_wing_folder)
+
+                #save the cropped wings to their path (these images will be resized to cropped_dim)
                 print(f"saving: {cropped_wing_path}")
-                cv2.imwrite(cropped_wing_path, cv2.cvtColor(cropped_wing, cv2.COLOR_RGB2BGR))
-            except FileNotFoundError:
-                errors.append(cropped_wing_path)
+                saved_wings.append(pool.submit(save_cropped_wing, cropped_wing_path, cropped_wing))
+
+    #collect any crops that failed to save
+    for future in saved_wings:
+        failed_path = future.result()
+        if failed_path is not None:
+            errors.append(failed_path)
     
     print('The following images could encountered errors during cropping/resizing:', errors)
     return
@@ -1,9 +1,5 @@
 import os
-import glob
 import cv2
-import numpy as np
-from matplotlib import pyplot as plt
-import pandas as pd
 import argparse
 
 from utils import load_dataset_images
@@ -22,7 +18,8 @@ def main():
 
     # load in our images
     image_dataset_folder = args.image_dataset_path + '/*'
-    dataset_images, image_filepaths = load_dataset_images(image_dataset_folder, 1)
+    #keep opencv's BGR order since the images are only written back out with opencv
+    dataset_images, image_filepaths = load_dataset_images(image_dataset_folder, 1, rgb=False)
 
     #load in our masks
     mask_dataset_folder = args.mask_dataset_path + '/*'
@@ -41,7 +38,7 @@ def main():
 
         #save the resized cropped wings to their path
         try:
-            cv2.imwrite(bck_img_path, cv2.cvtColor(img_removed_background, cv2.COLOR_RGB2BGR))
+            cv2.imwrite(bck_img_path, img_removed_background)
         except FileNotFoundError:
             errors.append(bck_img_path)
             
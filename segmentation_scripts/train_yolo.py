@@ -1,12 +1,5 @@
-import os
-import glob
-import pandas as pd
-import numpy as np
 import torch
-import cv2
-import matplotlib.pyplot as plt
 from ultralytics import YOLO
-from skimage.draw import polygon2mask
 
 def main():
     #define path to yaml file containing info about our dataset
@@ -2,11 +2,13 @@ import os
 import glob
 import cv2
 import numpy as np
+from PIL import Image
 
-def load_dataset_images(dataset_path, color_option=0):
-    '''Load in actual images from filepaths from all subfolders in the provided dataset_path'''
+IMAGE_EXTENSIONS = {".jpg", ".JPG", ".jpeg", ".png"}
 
-    file_extensions = ["jpg", "JPG", "jpeg", "png"]
+def get_image_filepaths(dataset_path):
+    '''Get the sorted filepaths of all images in the provided dataset_path (a glob pattern, ex. /path/to/images/*)
+    and in its subfolders'''
 
     #Get training images and mask paths then sort
     image_filepaths = []
@@ -14,13 +16,33 @@ def load_dataset_images(dataset_path, color_option=0):
         if os.path.isfile(directory_path):
             image_filepaths.append(directory_path)
         elif os.path.isdir(directory_path):
-            for ext in file_extensions:
-                for img_path in glob.glob(os.path.join(directory_path, f"*.{ext}")):
-                    image_filepaths.append(img_path)
-
+            #a single scandir pass per folder, matching extensions against a set rather than globbing once per extension
+            for entry in os.scandir(directory_path):
+                if not entry.name.startswith('.') and os.path.splitext(entry.name)[1] in IMAGE_EXTENSIONS:
+                    image_filepaths.append(entry.path)
 
     #sort image and mask fps to ensure we have the same order to index
     image_filepaths.sort()
+    return image_filepaths
+
+
+def is_valid_image(image_path):
+    '''Check that the file at image_path is a readable image by fully decoding it, so that files with a
+    corrupt header or truncated image data are both caught'''
+    try:
+        with Image.open(image_path) as img:
+            img.load()
+        return True
+    except Exception:
+        return False
+
+
+def load_dataset_images(dataset_path, color_option=0, rgb=True):
+    '''Load in actual images from filepaths from all subfolders in the provided dataset_path.
+    Color images are returned in RGB order unless rgb=False, in which case opencv's BGR order is kept
+    (useful when the images are only going to be written back out with opencv)'''
+
+    image_filepaths = get_image_filepaths(dataset_path)
 
     #get actual masks and images
     dataset_images = []
@@ -32,7 +54,8 @@ def load_dataset_images(dataset_path, color_option=0):
         elif color_option == 1:
             #read in color and reverse order to RGB since opencv reads in BGR
             img = cv2.imread(img_path)
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            if rgb:
+                img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
         dataset_images.append(img)
 
     try:
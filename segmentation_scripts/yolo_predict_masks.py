@@ -1,15 +1,16 @@
 import os
-import glob
 import wget
-import pandas as pd
 import numpy as np
 import torch
 import argparse
+import csv
 import cv2
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from ultralytics import YOLO
 from skimage.draw import polygon2mask
 
-from utils import load_dataset_images
+from utils import get_image_filepaths, is_valid_image
 
 def get_yolo_model():
     '''Download trained yolo v8 model from huggingface and load in weights'''
@@ -26,11 +27,11 @@ def get_yolo_model():
 
 
 def get_mask(r):
-    #get the original image
-    image = cv2.cvtColor(r.orig_img, cv2.COLOR_BGR2RGB)
+    #get the (height, width) of the original image
+    image_shape = r.orig_shape
 
     #create an empty array to add our masks onto
-    segmented_img_full = np.zeros(image[:,:,0].shape, dtype='uint8')
+    segmented_img_full = np.zeros(image_shape, dtype='uint8')
 
     #get the xyn coordinates and ids of the predicted masks
     predicted_class_ids = r.boxes.cls.tolist()
@@ -44,28 +45,59 @@ def get_mask(r):
         #polygon2mask expects coordinates in y,x order so reorder
         #since we're using the normalized xy coordinates, we also multiply x and y 
         #by the target image's width and height so that our masks scale and fit the target img
-        coords_adj = [[y * image.shape[0], x * image.shape[1]] for [x,y] in coords] 
+        polygon = coords[:, ::-1] * image_shape
 
         #build mask from normalized coords
-        polygon = np.array(coords_adj)
-        mask = polygon2mask(image[:,:,0].shape, polygon).astype("uint8")
+        mask = polygon2mask(image_shape, polygon).astype("uint8")
 
         #assign the class id as the pixel value for the segment such that
         #instead of 1s and 0s, it'll be class_id's and 0's
         mask *= int(class_id) 
 
-        #layer the current segment into one collective mask
-        segmented_img_full += mask
+        #layer the current segment into one collective mask, replacing values where masks
+        #overlap to avoid pixel values not in our id2label mapping
+        np.copyto(segmented_img_full, mask, where=mask != 0)
 
-        for y in range(0, segmented_img_full.shape[0]):
-            for x in range(0, segmented_img_full.shape[1]):
-                #if there masks overlap at y,x
-                if mask[y, x] != 0 and segmented_img_full[y,x] != 0:
-                    #replace that value to avoid pixel values not in our id2label mapping
-                    segmented_img_full[y,x] = mask[y,x]
-    
-    print(predicted_class_ids)
     return segmented_img_full
+
+
+def save_mask(mask_path, mask, png_params):
+    '''Save a mask with opencv to preserve pixel categories. Returns the path if the mask could not be saved'''
+    try:
+        saved = cv2.imwrite(mask_path, mask, png_params)
+    except cv2.error:
+        saved = False
+
+    return None if saved else mask_path
+
+
+def get_class_presence(mask, num_classes):
+    '''Get a vector with `1` for all segmentation classes that appear in the mask and `0` for those that were not predicted'''
+    #bincount counts every label in one pass instead of sorting the mask like np.unique
+    presence = np.zeros(num_classes, dtype=np.uint8)
+    presence[np.flatnonzero(np.bincount(mask.ravel()))] = 1
+    return presence
+
+
+def get_saved_mask_presence(mask_path, num_classes):
+    '''Get the class presence of a mask saved by a previous run. Returns None if the mask is missing or
+    can't be read (ex. a write cut short when the previous run was interrupted), so that it gets predicted again'''
+    if not os.path.exists(mask_path):
+        return None
+
+    mask = cv2.imread(mask_path, cv2.IMREAD_GRAYSCALE)
+    if mask is None:
+        return None
+
+    return get_class_presence(mask, num_classes)
+
+
+def predict_in_batches(model, filepaths, batch_size, half=False):
+    '''Yield the YOLO results for filepaths one at a time, running inference on batch_size images at a time.
+    ultralytics decodes and predicts a list source all at once, so we hand it fixed-size slices to keep
+    only one batch of images and predictions in memory'''
+    for i in range(0, len(filepaths), batch_size):
+        yield from model.predict(filepaths[i:i + batch_size], half=half, verbose=False)
         
 
 def parse_args():
@@ -73,20 +105,25 @@ def parse_args():
     parser.add_argument("--dataset", required=True, help="Directory containing images we want to predict masks for. ex: /User/micheller/data/jiggins_256_256")
     parser.add_argument("--segmentation_csv", required=False, default = 'dataset_segmentation_info.csv', help="Path to the csv created containing \
                         which segmentation classes are present in each image's predicted mask.")
+    parser.add_argument("--skip_existing", action="store_true", help="Don't re-predict masks for images that already have a saved mask \
+                        (e.g. when resuming an interrupted run). Their rows in the csv are filled in from the saved masks.")
+    parser.add_argument("--batch_size", required=False, type=int, default=16, help="Number of images to load and run through the model at once.")
+    parser.add_argument("--half", action="store_true", help="Run inference in FP16 half precision when a GPU is available (faster, with negligible changes to the masks).")
+    parser.add_argument("--verbose", action="store_true", help="Print the mask path and predicted classes for each image.")
     return parser.parse_args()
 
 
 def main():
     args = parse_args()
 
-    # Load in our images that we need to get masks for
+    # Get the paths of the images we need to get masks for
     dataset_folder = args.dataset + '/*'
-    dataset_images, image_filepaths = load_dataset_images(dataset_folder)
+    image_filepaths = get_image_filepaths(dataset_folder)
 
     # Get Model
     model = get_yolo_model()
 
-    # Create a dataframe to store all metadata associated with predicted masks
+    # Segmentation classes predicted by the model
     classes = {0: 'background',
             1: 'right_forewing',
             2: 'left_forewing',
@@ -97,13 +134,6 @@ def main():
             7: 'label',
             8: 'color_card',
             9: 'body'}
-    
-    dataset_segmented = pd.DataFrame(columns = ['image', 'background', 
-                                            'right_forewing', 'left_forewing', 
-                                            'right_hindwing', 'left_hindwing', 
-                                            'ruler', 'white_balance', 
-                                            'label', 'color_card', 'body'])
-    
 
     # Leverage GPU if available
     use_cuda = torch.cuda.is_available()
@@ -116,48 +146,81 @@ def main():
         print('__CUDA Device Name:',torch.cuda.get_device_name(0))
         print('__CUDA Device Total Memory [GB]:',torch.cuda.get_device_properties(0).total_memory/1e9)
 
-    # Predict masks on all our images
-    results = model.predict(image_filepaths, verbose=False)
-    
-    # Go through results and build masks where each segmented item is encoded with its class ID as pixel values
-    i=0
-    for r, fp in zip(results, image_filepaths):
-        #get the mask with category id's as pixel values
-        mask = get_mask(r) 
-        
-        #create the path to which the mask will be saved, replicating the folder + naming structure of the input dataset
-        mask_path = fp.replace(args.dataset, f'{args.dataset}_masks')
-        mask_path = mask_path.replace(f".{fp.split('.')[-1]}", "_mask.png") #replace extension and save mask as a png
-        
-        #create the folder in which the mask will be saved in if it doesn't exist already
-        mask_filename = "/" + mask_path.split('/')[-1] #
-        mask_folder = mask_path.replace(mask_filename, "")
-        os.makedirs(mask_folder, exist_ok=True)
-        
-        #save mask with cv2 to preserve pixel categories
-        print(f"Mask path:{mask_path}")
-        cv2.imwrite(mask_path, mask)
-
-        #enter relevant segmentation data for the image in our dataframe
-        classes_in_image = np.unique(mask)
-        classes_not_in_image = set(classes.keys()) ^ set(classes_in_image)
-        dataset_segmented.loc[i, 'image'] = fp
-        
-        #enter `1` for all segmentation classes that appear in our mask
-        for val in classes_in_image:
-            pred_class = classes[val]
-            dataset_segmented.loc[i, pred_class] = 1 #class exists in segmentation mask
+    # Create the paths to which the masks will be saved, replicating the folder + naming structure of the input dataset
+    mask_paths = [fp.replace(args.dataset, f'{args.dataset}_masks').replace(f".{fp.split('.')[-1]}", "_mask.png") #save masks as pngs
+                  for fp in image_filepaths]
 
-        #enter `0` for all segmentation classes that were not predicted
-        for not_pred_val in classes_not_in_image:
-            not_pred_class = classes[not_pred_val]
-            dataset_segmented.loc[i, not_pred_class] = 0 #class does not exist in segmentation mask
+    # Read the masks that were already saved by a previous run (this is I/O bound, so read them in parallel)
+    # and keep just their class presence; missing or unreadable masks are left as None to be predicted again
+    if args.skip_existing:
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+            saved_presence = list(pool.map(partial(get_saved_mask_presence, num_classes=len(classes)), mask_paths))
+    else:
+        saved_presence = [None] * len(mask_paths)
+    predict_filepaths = [fp for fp, presence in zip(image_filepaths, saved_presence) if presence is None]
+
+    # Drop corrupt/truncated images we still need to predict up front instead of failing partway through inference
+    # (images with a readable saved mask are never decoded; PIL releases the GIL while decoding, so check them in parallel)
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+        predict_valid = list(pool.map(is_valid_image, predict_filepaths))
+    invalid_filepaths = {fp for fp, valid in zip(predict_filepaths, predict_valid) if not valid}
+    if invalid_filepaths:
+        print(f"Skipping {len(invalid_filepaths)} unreadable images:")
+        for fp in sorted(invalid_filepaths):
+            print(f"  {fp}")
+        keep = [fp not in invalid_filepaths for fp in image_filepaths]
+        image_filepaths = [fp for fp, k in zip(image_filepaths, keep) if k]
+        mask_paths = [mask_path for mask_path, k in zip(mask_paths, keep) if k]
+        saved_presence = [presence for presence, k in zip(saved_presence, keep) if k]
+        predict_filepaths = [fp for fp, valid in zip(predict_filepaths, predict_valid) if valid]
+    print(f"Predicting masks for {len(predict_filepaths)} of {len(image_filepaths)} images")
+
+    # Predict masks on the remaining images one batch at a time so we never hold
+    # every image and its predictions in memory at once
+    # (half precision is only used on the GPU; on the CPU we always run in FP32)
+    half = args.half and use_cuda
+    results = predict_in_batches(model, predict_filepaths, args.batch_size, half=half)
+    
+    # Masks are low-entropy label images, so fast RLE-based png compression is nearly free
+    png_params = [cv2.IMWRITE_PNG_COMPRESSION, 1, cv2.IMWRITE_PNG_STRATEGY, cv2.IMWRITE_PNG_STRATEGY_RLE]
 
-        i += 1
+    # Go through results and build masks where each segmented item is encoded with its class ID as pixel values
+    # Masks are written from a thread pool so disk I/O overlaps with inference on the next batch
+    # Rows of the csv containing information about segmentation masks per each image are written as we go
+    saved_masks = [] #futures for each mask being written
+    mask_folders = set() #folders we've already created
+    with open(args.segmentation_csv, 'w', newline='') as segmentation_file, \
+         ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+        segmentation_writer = csv.writer(segmentation_file)
+        segmentation_writer.writerow(['image', *classes.values()])
+
+        for fp, mask_path, presence in zip(image_filepaths, mask_paths, saved_presence):
+            #reuse the class presence of the mask saved by a previous run if we have it
+            if presence is None:
+                #get the mask with category id's as pixel values
+                r = next(results)
+                mask = get_mask(r)
+
+                #create the folder in which the mask will be saved in if it doesn't exist already
+                mask_folder = os.path.dirname(mask_path)
+                if mask_folder not in mask_folders:
+                    os.makedirs(mask_folder, exist_ok=True)
+                    mask_folders.add(mask_folder)
+
+                #save mask with cv2 to preserve pixel categories
+                if args.verbose:
+                    print(f"Mask path:{mask_path}, predicted classes: {r.boxes.cls.tolist()}")
+                saved_masks.append(pool.submit(save_mask, mask_path, mask, png_params))
+
+                presence = get_class_presence(mask, len(classes))
+
+            segmentation_writer.writerow([fp, *presence.tolist()])
+
+    #collect any masks that failed to save
+    errors = [future.result() for future in saved_masks if future.result() is not None]
+    if errors:
+        print('The following masks could not be saved:', errors)
 
-    # Save csv containing information about segmentation masks per each image
-    dataset_segmented.to_csv(args.segmentation_csv, index=False)
-    
     return
 
 